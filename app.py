@@ -8,8 +8,14 @@ st.set_page_config(
 
 import os, json
 from utils.note_manager import load_notes, save_note, delete_note, update_note
-from utils.question_generator import generate_questions, evaluate_answer
-from config import QUESTIONS_DIR
+from utils.question_generator import (
+    generate_questions,
+    evaluate_answer,
+    regenerate_changed_questions,
+    delete_questions,
+    LLMBusyError,
+)
+from config import QUESTIONS_DIR, MAX_QUESTIONS_PER_NOTE, USER_ID_PATTERN, get_user_dir
 from utils.stats_manager import get_all_stats, save_quiz_result, delete_note_stats, delete_all_stats
 
 # Application principale
@@ -26,6 +32,26 @@ menu = st.sidebar.radio(
     key="menu_radio"
 )
 
+# Espace utilisateur : chaque identifiant dispose de ses propres notes, questions et stats
+user_id = st.sidebar.text_input(
+    "👤 Identifiant utilisateur",
+    key="user_id_input",
+    help="Laissez vide pour utiliser l'espace partagé. L'identifiant sépare les données mais ne les protège pas : "
+         "toute personne qui le saisit y a accès."
+).strip() or None
+if user_id and not USER_ID_PATTERN.fullmatch(user_id):
+    st.sidebar.error("Identifiant invalide : lettres, chiffres, '-' et '_' uniquement (64 caractères max).")
+    st.stop()
+
+# Vider les données en cache lors d'un changement d'utilisateur
+if st.session_state.get("current_user", None) != user_id:
+    for key in ("notes", "editing_note", "questions", "current_note", "user_answers"):
+        st.session_state.pop(key, None)
+    # Effacer aussi les réponses saisies dans les champs du quiz
+    for key in [key for key in st.session_state if str(key).startswith("answer_")]:
+        del st.session_state[key]
+    st.session_state.current_user = user_id
+
 # Main content
 if menu == "Dashboard":
     # Header with custom styles
@@ -53,11 +79,15 @@ elif menu == "Prise de Notes":
     st.header("Prise de Notes")
     
     if "notes" not in st.session_state:
-        st.session_state.notes = load_notes()
+        st.session_state.notes = load_notes(user_id)
     
     if "editing_note" not in st.session_state:
         st.session_state.editing_note = None
 
+    # Avertissement conservé à travers le rechargement de la page
+    if "note_warning" in st.session_state:
+        st.warning(st.session_state.pop("note_warning"))
+
     # Affichage des notes existantes
     st.write("### Vos notes :")
     if st.session_state.notes:
@@ -70,8 +100,8 @@ elif menu == "Prise de Notes":
                     st.session_state.editing_note = note
             with col3:
                 if st.button("Supprimer", key=f"delete_{note['title']}"):
-                    delete_note(note['title'])
-                    st.session_state.notes = load_notes()
+                    delete_note(note['title'], user_id)
+                    st.session_state.notes = load_notes(user_id)
                     if st.session_state.editing_note and st.session_state.editing_note['title'] == note['title']:
                         st.session_state.editing_note = None
                     st.rerun()
@@ -91,9 +121,24 @@ elif menu == "Prise de Notes":
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Sauvegarder les modifications"):
-                if update_note(st.session_state.editing_note['title'], edited_content):
+                if update_note(st.session_state.editing_note['title'], edited_content, user_id):
+                    # Régénérer uniquement les questions des sections modifiées
+                    with st.spinner("Mise à jour des questions en cours..."):
+                        try:
+                            regenerate_changed_questions(
+                                st.session_state.editing_note['title'],
+                                st.session_state.editing_note['content'],
+                                edited_content,
+                                user_id
+                            )
+                        except Exception as e:
+                            st.session_state.note_warning = (
+                                f"Note enregistrée, mais les questions n'ont pas pu être mises à jour : {e}. "
+                                "Elles le seront à la prochaine modification."
+                            )
+                    st.session_state.pop("questions", None)
                     st.success("Note mise à jour avec succès!")
-                    st.session_state.notes = load_notes()
+                    st.session_state.notes = load_notes(user_id)
                     st.session_state.editing_note = None
                     st.rerun()
                 else:
@@ -110,8 +155,8 @@ elif menu == "Prise de Notes":
     note_content = st.text_area("Contenu de la note", height=200)
     if st.button("Sauvegarder"):
         if note_title and note_content:
-            save_note(note_title, note_content)
-            st.session_state.notes = load_notes()
+            save_note(note_title, note_content, user_id)
+            st.session_state.notes = load_notes(user_id)
             st.success(f"Note '{note_title}' sauvegardée avec succès !")
             st.rerun()
         else:
@@ -123,13 +168,13 @@ elif menu == "Mode Quiz":
     st.header("Mode Quiz")
     
     # Charger les notes disponibles
-    notes = load_notes()
+    notes = load_notes(user_id)
     note_titles = [note["title"] for note in notes]
     selected_note = st.selectbox("Choisissez une note", note_titles)
 
     if selected_note:
         note_content = next(note["content"] for note in notes if note["title"] == selected_note)
-        json_file_path = os.path.join(QUESTIONS_DIR, f"{selected_note}.json")
+        json_file_path = os.path.join(get_user_dir(QUESTIONS_DIR, user_id), f"{selected_note}.json")
         
         # Initialisation des questions
         if "questions" not in st.session_state or st.session_state.get("current_note") != selected_note:
@@ -143,22 +188,38 @@ elif menu == "Mode Quiz":
             st.session_state.user_answers = {}
 
         # Générer de nouvelles questions
+        merge_questions = st.checkbox(
+            "Conserver les questions existantes",
+            value=True,
+            help="Ajoute uniquement les questions nouvelles, sans doublons."
+        )
         if st.button("Générer des questions"):
-            try:
-                with st.spinner("Génération des questions en cours..."):
-                    new_questions = generate_questions(selected_note, note_content)
-                
-                if new_questions:
-                    with open(json_file_path, "w") as file:
-                        json.dump(new_questions, file, indent=4, ensure_ascii=False)
+            previous_count = len(st.session_state.questions)
+            if merge_questions and previous_count >= MAX_QUESTIONS_PER_NOTE:
+                st.warning(
+                    f"Cette note a déjà {previous_count} questions (maximum {MAX_QUESTIONS_PER_NOTE}). "
+                    "Supprimez les questions ou décochez l'option de fusion pour en générer de nouvelles."
+                )
+            else:
+                try:
+                    with st.spinner("Génération des questions en cours..."):
+                        new_questions = generate_questions(selected_note, note_content, user_id, merge=merge_questions)
                     
-                    st.session_state.questions = new_questions
-                    st.session_state.user_answers = {}  # Réinitialiser les réponses
-                    st.success("Questions générées et sauvegardées avec succès !")
-                else:
-                    st.error("L'API n'a retourné aucune question.")
-            except Exception as e:
-                st.error(f"Une erreur s'est produite : {e}")
+                    if new_questions:
+                        with open(json_file_path, "w") as file:
+                            json.dump(new_questions, file, indent=4, ensure_ascii=False)
+                        
+                        st.session_state.questions = new_questions
+                        st.session_state.user_answers = {}  # Réinitialiser les réponses
+                        added_count = len(new_questions) - previous_count if merge_questions else len(new_questions)
+                        if added_count > 0:
+                            st.success(f"{added_count} question(s) générée(s) et sauvegardée(s) avec succès !")
+                        else:
+                            st.info("Aucune nouvelle question : toutes les questions générées existaient déjà.")
+                    else:
+                        st.error("L'API n'a retourné aucune question.")
+                except Exception as e:
+                    st.error(f"Une erreur s'est produite : {e}")
 
         # Afficher les questions
         if st.session_state.questions:
@@ -180,17 +241,23 @@ elif menu == "Mode Quiz":
             # Bouton unique pour vérifier toutes les réponses
             if st.button("📝 Vérifier toutes les réponses"):
                 total_score = 0
+                evaluated = 0
                 with st.spinner("Évaluation des réponses en cours..."):
                     for i, question in enumerate(st.session_state.questions, 1):
                         answer_key = f"answer_{i}"
                         user_answer = st.session_state.user_answers.get(answer_key, "")
                         
                         # Évaluer la réponse
-                        evaluation = evaluate_answer(
-                            question['text'],
-                            user_answer,
-                            question['reponse']
-                        )
+                        try:
+                            evaluation = evaluate_answer(
+                                question['text'],
+                                user_answer,
+                                question['reponse'],
+                                user_id
+                            )
+                        except LLMBusyError as e:
+                            st.error(str(e))
+                            break
                         
                         # Sauvegarder le résultat
                         save_quiz_result(
@@ -198,10 +265,13 @@ elif menu == "Mode Quiz":
                             question['text'],
                             user_answer,
                             question['reponse'],
-                            evaluation['score']
+                            evaluation['score'],
+                            user_id,
+                            question.get('id')
                         )
                         
                         total_score += evaluation['score']
+                        evaluated += 1
                         
                         # Afficher le résultat pour cette question
                         with st.expander(f"Résultat Question {i}"):
@@ -210,8 +280,9 @@ elif menu == "Mode Quiz":
                             st.write(f"**Score:** {evaluation['score']}/5")
                 
                 # Afficher le score total
-                avg_score = total_score / len(st.session_state.questions)
-                st.success(f"Score total : {avg_score:.1f}/5")
+                if evaluated:
+                    avg_score = total_score / evaluated
+                    st.success(f"Score total : {avg_score:.1f}/5")
                 
                 # Option pour recommencer
                 if st.button("🔄 Recommencer le quiz"):
@@ -221,7 +292,7 @@ elif menu == "Mode Quiz":
             # Bouton pour supprimer les questions
             if st.button("🗑️ Supprimer toutes les questions"):
                 try:
-                    os.remove(json_file_path)
+                    delete_questions(selected_note, user_id)
                     st.session_state.questions = []
                     st.session_state.user_answers = {}
                     st.success("Les questions ont été supprimées avec succès !")
@@ -236,7 +307,7 @@ elif menu == "Mode Quiz":
 elif menu == "Performances":
     st.header("📊 Performances d'apprentissage")
     
-    stats = get_all_stats()
+    stats = get_all_stats(user_id)
     if not stats:
         st.info("Aucune statistique disponible pour le moment. Commencez à répondre à des quiz pour voir vos performances !")
     else:
@@ -298,7 +369,7 @@ elif menu == "Performances":
                     
                     # Bouton pour supprimer l'historique de cette note
                     if st.button("🗑️ Supprimer l'historique", key=f"delete_{note_title}"):
-                        if delete_note_stats(note_title):
+                        if delete_note_stats(note_title, user_id):
                             st.success(f"Historique supprimé pour {note_title}")
                             st.rerun()
                         else:
@@ -307,7 +378,7 @@ elif menu == "Performances":
         # Bouton pour supprimer tout l'historique
         st.markdown("---")
         if st.button("🗑️ Supprimer tout l'historique", type="secondary"):
-            if delete_all_stats():
+            if delete_all_stats(user_id):
                 st.success("Tout l'historique a été supprimé")
                 st.rerun()
             else:
@@ -1,4 +1,5 @@
 import os
+import re
 
 # Dossier ou les notes seront sauvegardées
 NOTES_DIR = "./notes/"
@@ -17,3 +18,42 @@ QUESTIONS_FILE = os.path.join(QUESTIONS_DIR, "questions.json")
 STATS_DIR = "./stats/"
 if not os.path.exists(STATS_DIR):
     os.makedirs(STATS_DIR)
+
+# Dossier racine des espaces utilisateurs (déploiement multi-utilisateurs)
+USERS_DIR = "./users/"
+
+# Nombre maximal d'appels simultanés à l'API par utilisateur (l'espace partagé n'est pas limité)
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "2"))
+
+# Délai maximal (en secondes) d'attente d'un appel libre avant de signaler une surcharge
+LLM_SLOT_TIMEOUT = float(os.getenv("LLM_SLOT_TIMEOUT", "30"))
+
+# Format autorisé pour un identifiant utilisateur
+USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def get_user_dir(base_dir, user_id=None, create=False):
+    """
+    Retourne le dossier de données propre à un utilisateur.
+    L'identifiant sépare les données mais ne protège pas leur accès : il n'est pas authentifié.
+    :param base_dir: Dossier global (NOTES_DIR, QUESTIONS_DIR ou STATS_DIR)
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
+    :param create: Si True, crée le dossier s'il n'existe pas (à réserver aux écritures)
+    :return: Chemin du dossier
+    """
+    if not user_id:
+        path = base_dir
+    else:
+        if not USER_ID_PATTERN.fullmatch(user_id):
+            raise ValueError(f"Identifiant utilisateur invalide : {user_id!r}")
+        path = os.path.join(USERS_DIR, user_id, os.path.basename(os.path.normpath(base_dir)))
+    if create and not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+# Seuil de similarité (cosinus TF-IDF, énoncé et couple question/réponse) au-delà duquel deux questions
+# sont considérées identiques. Calibré sur des paires réelles : les reformulations obtiennent au moins 0.45,
+# les questions distinctes au même gabarit (TCP/UDP, ls/cd, chmod 755/644) au plus 0.42.
+QUESTION_SIMILARITY_THRESHOLD = 0.45
+
+# Nombre maximal de questions conservées par note
+MAX_QUESTIONS_PER_NOTE = 30
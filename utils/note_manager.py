@@ -1,37 +1,67 @@
 import os
-from config import NOTES_DIR  
+import re
+import hashlib
+from config import NOTES_DIR, get_user_dir
 
-def load_notes():
+def load_notes(user_id=None):
     notes = []
-    if not os.path.exists(NOTES_DIR):
-        os.makedirs(NOTES_DIR)
-    for filename in os.listdir(NOTES_DIR):
+    notes_dir = get_user_dir(NOTES_DIR, user_id)
+    if not os.path.exists(notes_dir):
+        return notes
+    for filename in os.listdir(notes_dir):
         if filename.endswith(".txt"):
-            with open(os.path.join(NOTES_DIR, filename), "r") as file:
+            with open(os.path.join(notes_dir, filename), "r") as file:
                 notes.append({"title": filename.replace(".txt", ""), "content": file.read()})
     return notes
 
-def save_note(title, content):
-    if not os.path.exists(NOTES_DIR):
-        os.makedirs(NOTES_DIR)
-    with open(os.path.join(NOTES_DIR, f"{title}.txt"), "w") as file:
+def save_note(title, content, user_id=None):
+    notes_dir = get_user_dir(NOTES_DIR, user_id, create=True)
+    with open(os.path.join(notes_dir, f"{title}.txt"), "w") as file:
         file.write(content)
 
-def delete_note(title):
-    filepath = os.path.join(NOTES_DIR, f"{title}.txt")
+def delete_note(title, user_id=None):
+    filepath = os.path.join(get_user_dir(NOTES_DIR, user_id), f"{title}.txt")
     if os.path.exists(filepath):
         os.remove(filepath)
 
-def update_note(title, new_content):
+def update_note(title, new_content, user_id=None):
     """
     Met à jour le contenu d'une note existante
     :param title: Titre de la note
     :param new_content: Nouveau contenu
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
     :return: True si la mise à jour est réussie, False sinon
     """
-    filepath = os.path.join(NOTES_DIR, f"{title}.txt")
+    filepath = os.path.join(get_user_dir(NOTES_DIR, user_id), f"{title}.txt")
     if os.path.exists(filepath):
         with open(filepath, "w") as file:
             file.write(new_content)
         return True
     return False
+
+def split_sections(content):
+    """
+    Découpe une note en sections (paragraphes séparés par une ligne vide)
+    :param content: Contenu de la note
+    :return: Liste des sections non vides
+    """
+    return [section.strip() for section in re.split(r"\n\s*\n", content) if section.strip()]
+
+def section_id(section):
+    """
+    Calcule un identifiant stable pour une section, insensible aux espaces
+    """
+    return hashlib.sha1(" ".join(section.split()).encode("utf-8")).hexdigest()[:10]
+
+def diff_sections(old_ids, new_content):
+    """
+    Compare une note aux sections d'une version précédente
+    :param old_ids: Identifiants des sections de la version précédente
+    :param new_content: Nouveau contenu
+    :return: (sections ajoutées ou modifiées, identifiants des sections inchangées)
+    """
+    old_ids = set(old_ids)
+    new_sections = split_sections(new_content)
+    new_ids = {section_id(section) for section in new_sections}
+    changed_sections = [section for section in new_sections if section_id(section) not in old_ids]
+    return changed_sections, old_ids & new_ids
@@ -1,10 +1,25 @@
 import os
 import re
 import json
+import math
+import uuid
 import logging
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
 from openai import OpenAI
 from dotenv import load_dotenv
-from config import QUESTIONS_DIR, QUESTIONS_FILE
+from config import (
+    QUESTIONS_DIR,
+    QUESTIONS_FILE,
+    MAX_CONCURRENT_LLM_CALLS,
+    LLM_SLOT_TIMEOUT,
+    QUESTION_SIMILARITY_THRESHOLD,
+    MAX_QUESTIONS_PER_NOTE,
+    get_user_dir,
+)
+from utils.note_manager import split_sections, section_id, diff_sections
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -19,24 +34,205 @@ client = OpenAI(
     api_key=api_key,
 )
 
-def generate_questions(note_title, note_content):
+class LLMBusyError(RuntimeError):
     """
-    Génère des questions à partir du contenu des notes en utilisant l'API DeepSeek.
-    :param note_title: Titre de la note
-    :param note_content: Contenu de la note
-    :return: Une liste de questions générées
+    Levée lorsqu'un utilisateur a déjà atteint son nombre d'appels simultanés à l'API.
     """
-    try:
-        prompt = (
-            f"À partir de ce texte, crée des questions relativement ouvertes qui permettent l'apprentissage actif. "
-            f"Tu choisiras un nombre de questions adéquat en fonction de la longueur du texte.\n"
-            f"Pour chaque question, retourne un JSON avec deux clés : "
-            f"'text' pour la question et 'reponse' pour la réponse correcte.\n"
-            f"Texte : {note_content}\n"
-            f"Retourne uniquement du JSON, rien d'autre."
+
+# Quotas d'appels simultanés à l'API : utilisateur -> [sémaphore, appels en cours ou en attente]
+_llm_semaphores = {}
+_llm_semaphores_lock = threading.Lock()
+
+@contextmanager
+def _llm_slot(user_id=None):
+    """
+    Réserve un des appels simultanés autorisés pour l'utilisateur.
+    L'espace partagé (user_id None) n'est pas limité.
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
+    :raises LLMBusyError: si aucun appel ne se libère avant LLM_SLOT_TIMEOUT
+    """
+    if not user_id:
+        yield
+        return
+
+    with _llm_semaphores_lock:
+        entry = _llm_semaphores.setdefault(
+            user_id, [threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS), 0]
         )
+        entry[1] += 1
+    semaphore = entry[0]
+    try:
+        if not semaphore.acquire(timeout=LLM_SLOT_TIMEOUT):
+            raise LLMBusyError("Trop de requêtes en cours pour cet utilisateur, réessayez dans un instant.")
+        try:
+            yield
+        finally:
+            semaphore.release()
+    finally:
+        # Oublier le sémaphore dès que l'utilisateur n'a plus d'appel en cours
+        with _llm_semaphores_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _llm_semaphores[user_id]
+
+def _questions_file(user_id=None, create=False):
+    return os.path.join(get_user_dir(QUESTIONS_DIR, user_id, create), os.path.basename(QUESTIONS_FILE))
+
+# Mots outils et tournures de consigne, trop fréquents pour distinguer deux sujets
+_STOP_WORDS = frozenset("""
+    a au aux avec c ce ces cet cette d dans de des du elle elles en entre est et etre il ils j l la le les
+    leur leurs lui m mais moins n ne ni nous on ou par pas peut peuvent plus pour qu quoi que quel quelle
+    quelles quels qui s sa se ses son sont sous sur t ta te tres un une vos votre vous y
+    cest quest comment pourquoi fait faire sert signifie permet permettent utilise utilisee utilisees
+    utilises utiliser expliquez expliquer decrivez decrire citez donnez definissez role exemple exemples
+    principal principale principales principaux quelques different differente differents differentes
+""".split())
+
+def _tokens(text):
+    """
+    Découpe un texte normalisé (minuscules, sans accents ni ponctuation) en mots, sans les mots outils.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [word for word in re.findall(r"\w+", text) if word not in _STOP_WORDS]
+
+def _tfidf_vectors(texts):
+    """
+    Calcule les vecteurs TF-IDF normalisés d'une liste de textes.
+    Les mots présents dans beaucoup de textes (le sujet de la note, par exemple) pèsent peu.
+    """
+    counts = [Counter(_tokens(text)) for text in texts]
+    document_frequency = Counter(word for count in counts for word in count)
+    vectors = []
+    for count in counts:
+        vector = {
+            word: frequency * (math.log((1 + len(texts)) / (1 + document_frequency[word])) + 1)
+            for word, frequency in count.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        vectors.append({word: weight / norm for word, weight in vector.items()})
+    return vectors
+
+def _cosine(vector_a, vector_b):
+    if len(vector_a) > len(vector_b):
+        vector_a, vector_b = vector_b, vector_a
+    return sum(weight * vector_b.get(word, 0.0) for word, weight in vector_a.items())
+
+def merge_questions(existing_questions, new_questions,
+                    threshold=QUESTION_SIMILARITY_THRESHOLD, max_questions=MAX_QUESTIONS_PER_NOTE):
+    """
+    Fusionne de nouvelles questions dans une banque existante en écartant les quasi-doublons.
+    Deux questions sont des doublons si leurs énoncés et leurs couples question/réponse
+    sont tous deux similaires (cosinus TF-IDF au moins égal au seuil).
+    Les questions existantes et leurs identifiants sont conservés tels quels.
+    :param existing_questions: Questions déjà enregistrées pour la note
+    :param new_questions: Questions nouvellement générées
+    :param threshold: Similarité à partir de laquelle une question est un doublon
+    :param max_questions: Taille maximale de la banque
+    :return: La liste fusionnée des questions
+    """
+    merged = list(existing_questions)
+    candidates = [question for question in new_questions
+                  if isinstance(question, dict) and question.get("text")]
+    pool = [question for question in merged + candidates if isinstance(question, dict)]
+    text_vectors = _tfidf_vectors([question.get("text", "") for question in pool])
+    full_vectors = _tfidf_vectors(
+        [f"{question.get('text', '')} {question.get('reponse', '')}" for question in pool]
+    )
+    vectors = {id(question): (text_vectors[i], full_vectors[i]) for i, question in enumerate(pool)}
+
+    known = [vectors[id(question)] for question in merged if isinstance(question, dict)]
+    for question in candidates:
+        if len(merged) >= max_questions:
+            break
+        text_vector, full_vector = vectors[id(question)]
+        if any(min(_cosine(text_vector, other_text), _cosine(full_vector, other_full)) >= threshold
+               for other_text, other_full in known):
+            continue
+        merged.append(question)
+        known.append((text_vector, full_vector))
+    return _assign_ids(merged)
+
+def _assign_ids(questions):
+    for question in questions:
+        if isinstance(question, dict) and "id" not in question:
+            question["id"] = uuid.uuid4().hex[:8]
+    return questions
+
+def _trim_questions(questions, max_questions):
+    """
+    Retire des questions, en commençant par les sections qui en comptent le plus,
+    jusqu'à ne plus en avoir que max_questions.
+    """
+    questions = list(questions)
+    while questions and len(questions) > max(max_questions, 0):
+        per_section = Counter(question.get("section") for question in questions)
+        busiest = max(per_section, key=per_section.get)
+        del questions[max(i for i, question in enumerate(questions) if question.get("section") == busiest)]
+    return questions
+
+def _cap_questions(kept_questions, new_questions, max_questions=MAX_QUESTIONS_PER_NOTE):
+    """
+    Limite la taille de la banque à max_questions. Les anciennes questions sont retirées en premier ;
+    les nouvelles ne le sont que si elles dépassent à elles seules la limite.
+    """
+    new_questions = _trim_questions(new_questions, max_questions)
+    kept = _trim_questions(kept_questions, max_questions - len(new_questions))
+    return kept + new_questions
+
+def _sections_file(json_file_path):
+    # Dossier à part, pour qu'aucune banque de questions <titre>.json ne puisse le remplacer
+    directory, filename = os.path.split(json_file_path)
+    return os.path.join(directory, ".sections", filename)
+
+def _save_covered_sections(json_file_path, sections):
+    """
+    Enregistre les sections de la note auxquelles la banque de questions est à jour.
+    """
+    sections_file = _sections_file(json_file_path)
+    if not os.path.exists(os.path.dirname(sections_file)):
+        os.makedirs(os.path.dirname(sections_file))
+    with open(sections_file, "w") as file:
+        json.dump([section_id(section) for section in sections], file, indent=4)
+
+def _load_covered_sections(json_file_path):
+    sections_file = _sections_file(json_file_path)
+    if os.path.exists(sections_file):
+        try:
+            with open(sections_file, "r") as file:
+                return set(json.load(file))
+        except json.JSONDecodeError as json_err:
+            logging.error("Fichier de sections illisible %s : %s", sections_file, json_err)
+    return None
+
+def _load_note_questions(json_file_path):
+    if os.path.exists(json_file_path):
+        try:
+            with open(json_file_path, "r") as file:
+                return json.load(file)
+        except json.JSONDecodeError as json_err:
+            logging.error("Fichier de questions illisible %s : %s", json_file_path, json_err)
+    return []
+
+def _request_questions(sections, user_id=None):
+    """
+    Demande à l'API des questions sur une liste de sections numérotées.
+    Chaque question est rattachée à l'identifiant de la section dont elle est tirée.
+    """
+    numbered_text = "\n\n".join(f"[{i}] {section}" for i, section in enumerate(sections, 1))
+    prompt = (
+        f"À partir de ce texte, crée des questions relativement ouvertes qui permettent l'apprentissage actif. "
+        f"Tu choisiras un nombre de questions adéquat en fonction de la longueur du texte.\n"
+        f"Le texte est découpé en passages numérotés entre crochets.\n"
+        f"Pour chaque question, retourne un JSON avec trois clés : "
+        f"'text' pour la question, 'reponse' pour la réponse correcte "
+        f"et 'section' pour le numéro du passage dont la question est tirée.\n"
+        f"Texte : {numbered_text}\n"
+        f"Retourne uniquement du JSON, rien d'autre."
+    )
 
-        # Envoyer la requête à l'API
+    # Envoyer la requête à l'API
+    with _llm_slot(user_id):
         response = client.chat.completions.create(
             extra_body={},
             model="deepseek/deepseek-chat",
@@ -45,60 +241,178 @@ def generate_questions(note_title, note_content):
             ],
         )
 
-        # Vérification de la réponse
-        logging.info("Réponse brute de l'API : %s", response)
-        generated_text = response.choices[0].message.content.strip()
-        if generated_text.startswith("```json") and generated_text.endswith("```"):
-            generated_text = generated_text.strip("```json").strip("```")
-        if not generated_text:
-            raise ValueError("Réponse vide retournée par l'API.")
+    # Vérification de la réponse
+    logging.info("Réponse brute de l'API : %s", response)
+    generated_text = response.choices[0].message.content.strip()
+    if generated_text.startswith("```json") and generated_text.endswith("```"):
+        generated_text = generated_text.strip("```json").strip("```")
+    if not generated_text:
+        raise ValueError("Réponse vide retournée par l'API.")
 
-        # Chargement du JSON
+    # Chargement du JSON
+    try:
+        questions = json.loads(generated_text)
+    except json.JSONDecodeError as json_err:
+        logging.error("Erreur lors de l'analyse du JSON : %s", json_err)
+        raise ValueError("La réponse de l'API n'est pas un JSON valide.")
+    if not isinstance(questions, list):
+        raise ValueError("La réponse de l'API n'est pas une liste de questions.")
+
+    return _assign_sections(questions, sections)
+
+def _assign_sections(questions, sections):
+    """
+    Remplace le numéro de passage de chaque question par l'identifiant de sa section.
+    À défaut de numéro valide, la section la plus proche du texte de la question est retenue.
+    """
+    for question in questions:
+        if not isinstance(question, dict) or not sections:
+            continue
+        number = question.get("section")
         try:
-            questions = json.loads(generated_text)
-        except json.JSONDecodeError as json_err:
-            logging.error("Erreur lors de l'analyse du JSON : %s", json_err)
-            raise ValueError("La réponse de l'API n'est pas un JSON valide.")
+            index = int(str(number).strip()) - 1
+        except ValueError:
+            index = -1
+        if isinstance(number, bool) or not 0 <= index < len(sections):
+            vectors = _tfidf_vectors(sections + [f"{question.get('text', '')} {question.get('reponse', '')}"])
+            index = max(range(len(sections)), key=lambda i: _cosine(vectors[-1], vectors[i]))
+        question["section"] = section_id(sections[index])
+    return questions
+
+def generate_questions(note_title, note_content, user_id=None, merge=False):
+    """
+    Génère des questions à partir du contenu des notes en utilisant l'API DeepSeek.
+    :param note_title: Titre de la note
+    :param note_content: Contenu de la note
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
+    :param merge: Si True, ajoute seulement les nouvelles questions à celles déjà enregistrées
+    :return: Une liste de questions générées (la banque complète en mode fusion)
+    """
+    try:
+        json_file_path = os.path.join(get_user_dir(QUESTIONS_DIR, user_id, create=True), f"{note_title}.json")
+        if merge:
+            # Inutile d'interroger l'API si la banque est déjà pleine
+            existing_questions = _load_note_questions(json_file_path)
+            if len(existing_questions) >= MAX_QUESTIONS_PER_NOTE:
+                logging.warning("Banque de questions pleine pour %s, aucune génération", note_title)
+                return existing_questions
+
+        sections = split_sections(note_content)
+        questions = _request_questions(sections, user_id)
+
+        # Fusionner avec les questions existantes ou les remplacer
+        if merge:
+            questions = merge_questions(existing_questions, questions)
+            logging.info("%d nouvelle(s) question(s) ajoutée(s)", len(questions) - len(existing_questions))
+        else:
+            questions = _assign_ids(_cap_questions(questions, []))
 
         # Sauvegarder les questions dans un fichier JSON
-        json_file_path = os.path.join(QUESTIONS_DIR, f"{note_title}.json")
         with open(json_file_path, "w") as file:
             json.dump(questions, file, indent=4, ensure_ascii=False)
+        _save_covered_sections(json_file_path, sections)
         logging.info("Questions sauvegardées dans : %s", json_file_path)
         return questions
 
+    except LLMBusyError:
+        raise
     except Exception as e:
         logging.error("Erreur lors de la génération des questions : %s", e)
         return []
 
-def save_questions(questions):
+def regenerate_changed_questions(note_title, old_content, new_content, user_id=None):
+    """
+    Met à jour les questions d'une note modifiée en ne régénérant que les sections ajoutées ou modifiées.
+    Les questions des sections inchangées sont conservées, celles des autres sections sont retirées.
+    Les sections sont comparées à la dernière version pour laquelle les questions ont été mises à jour,
+    si bien qu'une section dont la régénération a échoué sera de nouveau traitée à la modification suivante.
+    :param note_title: Titre de la note
+    :param old_content: Contenu de la note avant modification
+    :param new_content: Contenu de la note après modification
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
+    :return: La liste des questions mise à jour, None si la note n'a pas encore de questions
+    :raises Exception: si la régénération échoue (les questions enregistrées sont alors inchangées)
+    """
+    json_file_path = os.path.join(get_user_dir(QUESTIONS_DIR, user_id), f"{note_title}.json")
+    existing_questions = _load_note_questions(json_file_path)
+    if not existing_questions:
+        return None
+
+    try:
+        # Rattacher les anciennes questions sans section à la section la plus proche
+        old_sections = split_sections(old_content)
+        untagged = [question for question in existing_questions
+                    if isinstance(question, dict) and "section" not in question]
+        _assign_sections(untagged, old_sections)
+
+        covered_ids = _load_covered_sections(json_file_path)
+        if covered_ids is None:
+            # Banque antérieure au suivi des sections : elle correspond à l'ancienne version
+            _save_covered_sections(json_file_path, old_sections)
+            covered_ids = {section_id(section) for section in old_sections}
+        changed_sections, unchanged_ids = diff_sections(covered_ids, new_content)
+        kept_questions = [question for question in existing_questions
+                          if isinstance(question, dict) and question.get("section") in unchanged_ids]
+        new_questions = _request_questions(changed_sections, user_id) if changed_sections else []
+        logging.info(
+            "%d section(s) à régénérer, %d question(s) retirée(s)",
+            len(changed_sections), len(existing_questions) - len(kept_questions)
+        )
+        # La limite s'applique d'abord aux anciennes questions, puis seulement aux nouvelles
+        questions = _assign_ids(_cap_questions(kept_questions, new_questions))
+
+        with open(json_file_path, "w") as file:
+            json.dump(questions, file, indent=4, ensure_ascii=False)
+        _save_covered_sections(json_file_path, split_sections(new_content))
+        logging.info("Questions sauvegardées dans : %s", json_file_path)
+        return questions
+
+    except Exception as e:
+        logging.error("Erreur lors de la régénération des questions : %s", e)
+        raise
+
+def delete_questions(note_title, user_id=None):
+    """
+    Supprime la banque de questions d'une note et le suivi de ses sections.
+    :param note_title: Titre de la note
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
+    """
+    json_file_path = os.path.join(get_user_dir(QUESTIONS_DIR, user_id), f"{note_title}.json")
+    os.remove(json_file_path)
+    sections_file = _sections_file(json_file_path)
+    if os.path.exists(sections_file):
+        os.remove(sections_file)
+
+def save_questions(questions, user_id=None):
     """
     Sauvegarde les questions générées dans un fichier JSON.
     :param questions: Liste des questions
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
     """
     try:
-        if not os.path.exists(os.path.dirname(QUESTIONS_FILE)):
-            os.makedirs(os.path.dirname(QUESTIONS_FILE))
-        with open(QUESTIONS_FILE, "w") as file:
+        questions_file = _questions_file(user_id, create=True)
+        with open(questions_file, "w") as file:
             json.dump(questions, file, indent=4)
-        logging.info("Questions sauvegardées dans le fichier principal : %s", QUESTIONS_FILE)
+        logging.info("Questions sauvegardées dans le fichier principal : %s", questions_file)
     except Exception as e:
         logging.error("Erreur lors de la sauvegarde des questions : %s", e)
 
-def load_questions():
+def load_questions(user_id=None):
     """
     Charge les questions sauvegardées à partir du fichier JSON.
+    :param user_id: Identifiant de l'utilisateur, None pour l'espace partagé
     :return: Liste des questions
     """
     try:
-        if os.path.exists(QUESTIONS_FILE):
-            with open(QUESTIONS_FILE, "r") as file:
+        questions_file = _questions_file(user_id)
+        if os.path.exists(questions_file):
+            with open(questions_file, "r") as file:
                 return json.load(file)
     except Exception as e:
         logging.error("Erreur lors du chargement des questions : %s", e)
     return []
 
-def evaluate_answer(question, user_answer, correct_answer):
+def evaluate_answer(question, user_answer, correct_answer, user_id=None):
     """
     Évalue la réponse de l'utilisateur en utilisant l'API
     """
@@ -117,11 +431,12 @@ def evaluate_answer(question, user_answer, correct_answer):
             f"Utilise les guillemets doubles pour la clé \"score\"."
         )
 
-        response = client.chat.completions.create(
-            extra_body={},
-            model="deepseek/deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-        )
+        with _llm_slot(user_id):
+            response = client.chat.completions.create(
+                extra_body={},
+                model="deepseek/deepseek-chat",
+                messages=[{"role": "user", "content": prompt}],
+            )
 
         if not response or not response.choices:
             raise ValueError("L'API n'a pas retourné de choix valides.")
@@ -150,6 +465,8 @@ def evaluate_answer(question, user_answer, correct_answer):
 
         return {"score": evaluation["score"]}
 
+    except LLMBusyError:
+        raise
     except Exception as e:
         logging.exception("Erreur lors de l'évaluation de la réponse")
         return {"score": 0}
\ No newline at end of file
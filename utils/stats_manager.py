@@ -1,17 +1,15 @@
 import os
 import json
 from datetime import datetime
-from config import STATS_DIR
+from config import STATS_DIR, get_user_dir
 import logging
 
-def save_quiz_result(note_title, question_text, user_answer, correct_answer, score):
+def save_quiz_result(note_title, question_text, user_answer, correct_answer, score, user_id=None, question_id=None):
     """
     Sauvegarde le résultat d'une question de quiz
+    L'identifiant de la question permet de suivre son historique même si son énoncé change.
     """
-    if not os.path.exists(STATS_DIR):
-        os.makedirs(STATS_DIR)
-        
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
+    stats_file = os.path.join(get_user_dir(STATS_DIR, user_id, create=True), f"{note_title}_stats.json")
     
     # Charger les stats existantes ou créer un nouveau dictionnaire
     if os.path.exists(stats_file):
@@ -23,6 +21,7 @@ def save_quiz_result(note_title, question_text, user_answer, correct_answer, sco
     # Ajouter la nouvelle tentative
     attempt = {
         "timestamp": datetime.now().isoformat(),
+        "question_id": question_id,
         "question": question_text,
         "user_answer": user_answer,
         "correct_answer": correct_answer,
@@ -35,34 +34,35 @@ def save_quiz_result(note_title, question_text, user_answer, correct_answer, sco
     with open(stats_file, 'w') as f:
         json.dump(stats, f, indent=4, ensure_ascii=False)
 
-def get_note_stats(note_title):
+def get_note_stats(note_title, user_id=None):
     """
     Récupère les statistiques pour une note donnée
     """
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
+    stats_file = os.path.join(get_user_dir(STATS_DIR, user_id), f"{note_title}_stats.json")
     if os.path.exists(stats_file):
         with open(stats_file, 'r') as f:
             return json.load(f)
     return {"attempts": []}
 
-def get_all_stats():
+def get_all_stats(user_id=None):
     """
-    Récupère toutes les statistiques
+    Récupère toutes les statistiques de l'utilisateur
     """
     all_stats = {}
-    if os.path.exists(STATS_DIR):
-        for filename in os.listdir(STATS_DIR):
+    stats_dir = get_user_dir(STATS_DIR, user_id)
+    if os.path.exists(stats_dir):
+        for filename in os.listdir(stats_dir):
             if filename.endswith('_stats.json'):
                 note_title = filename.replace('_stats.json', '')
-                with open(os.path.join(STATS_DIR, filename), 'r') as f:
+                with open(os.path.join(stats_dir, filename), 'r') as f:
                     all_stats[note_title] = json.load(f)
     return all_stats
 
-def delete_note_stats(note_title):
+def delete_note_stats(note_title, user_id=None):
     """
     Supprime l'historique des stats pour une note donnée
     """
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
+    stats_file = os.path.join(get_user_dir(STATS_DIR, user_id), f"{note_title}_stats.json")
     try:
         if os.path.exists(stats_file):
             os.remove(stats_file)
@@ -71,15 +71,16 @@ def delete_note_stats(note_title):
         logging.error(f"Erreur lors de la suppression des stats de {note_title}: {e}")
     return False
 
-def delete_all_stats():
+def delete_all_stats(user_id=None):
     """
-    Supprime tout l'historique des stats
+    Supprime tout l'historique des stats de l'utilisateur
     """
     try:
-        if os.path.exists(STATS_DIR):
-            for filename in os.listdir(STATS_DIR):
+        stats_dir = get_user_dir(STATS_DIR, user_id)
+        if os.path.exists(stats_dir):
+            for filename in os.listdir(stats_dir):
                 if filename.endswith('_stats.json'):
-                    os.remove(os.path.join(STATS_DIR, filename))
+                    os.remove(os.path.join(stats_dir, filename))
             return True
     except Exception as e:
         logging.error(f"Erreur lors de la suppression de toutes les stats: {e}")